@@ -0,0 +1,142 @@
+import csv
+import gzip
+import json
+import os
+import sqlite3
+import time
+
+from db_handler import (compressible_cols, find_missing_indexes, print_index_hint,
+    read_compress_dicts, src_dict, unpack_value)
+
+class DBExporter:
+    def __init__(self, db_path: str, fetch_size: int = 1000):
+        self.db_path = db_path
+        self.fetch_size = fetch_size
+        self.columns = {
+            'msg_id': 'messages.msg_id',
+            'chat_id': 'messages.chat_id',
+            'chat_name': 'chats.chat_name',
+            'peer_type': 'chats.peer_type',
+            'date': 'messages.date',
+            'datetime': "datetime(messages.date, 'unixepoch', 'localtime')",
+            'from_id': 'messages.from_id',
+            'from_name': 'usernames.name',
+            'text': 'messages.text',
+            'attachments': 'messages.attachments',
+            'fwd_messages': 'messages.fwd_messages',
+            'is_service_msg': 'messages.is_service_msg',
+            'service_msg_data': 'messages.service_msg_data',
+            'edited': 'messages.edited',
+            'has_formatting': 'messages.has_formatting',
+            'reply_to_id': 'messages.reply_to_id',
+            'msg_id_orig': 'messages.msg_id_orig',
+            'data_src': 'messages.data_src'
+            }
+        self.json_cols = ( 'attachments', 'fwd_messages', 'service_msg_data' )
+
+    def build_query(self, columns: list, chat_ids: list, data_src: int,
+                    start_date: int, end_date: int):
+        select_list = ', '.join(f'{self.columns[c]} AS "{c}"' for c in columns)
+        conditions, params = [], []
+        if chat_ids:
+            conditions.append(f'messages.chat_id IN ({", ".join("?" * len(chat_ids))})')
+            params.extend(chat_ids)
+        if data_src:
+            conditions.append('messages.data_src = ?')
+            params.append(data_src)
+        if start_date is not None:
+            conditions.append('messages.date >= ?')
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append('messages.date < ?')
+            params.append(end_date)
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        # both orders match an index, so SQLite doesn't have to sort the whole result
+        if chat_ids:
+            order_by = 'messages.chat_id, messages.date, messages.msg_id'
+        else:
+            order_by = 'messages.date, messages.msg_id'
+        query = f"""
+        SELECT {select_list}
+        FROM messages
+        LEFT JOIN chats ON messages.chat_id = chats.chat_id
+        LEFT JOIN usernames ON messages.from_id = usernames.user_id
+        {where}
+        ORDER BY {order_by};
+        """
+        return query, params
+
+    def export(self, out_path: str, out_format: str = None, columns: list = None,
+               chat_ids: list = None, data_src: str = None,
+               start_date: int = None, end_date: int = None, use_gzip: bool = False):
+        columns = columns or list(self.columns)
+        for col in columns:
+            if col not in self.columns:
+                print(f'Error: unknown column {col}, available columns: {", ".join(self.columns)}')
+                return
+        if data_src and data_src not in src_dict:
+            print(f'Error: unknown data source {data_src}')
+            return
+        if out_path.endswith('.gz'):
+            use_gzip = True
+        if not out_format:
+            out_format = 'csv' if '.csv' in os.path.basename(out_path) else 'jsonl'
+
+        src_id = src_dict[data_src] if data_src else None
+        query, params = self.build_query(columns, chat_ids, src_id, start_date, end_date)
+        conn = sqlite3.connect(f'file:{os.path.abspath(self.db_path)}?mode=rw', uri=True)
+        conn.execute('PRAGMA query_only = ON;')
+        table_query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages';"
+        if not conn.execute(table_query).fetchone():
+            print(f'Error: {self.db_path} is not a mulmes2sqlite database (no messages table)')
+            conn.close()
+            return
+        compress_dicts = read_compress_dicts(conn)
+        if find_missing_indexes(conn): # DBs created by older versions
+            print_index_hint(self.db_path, 'export')
+        start_time = time.time()
+        row_count = 0
+        if use_gzip:
+            out_file = gzip.open(out_path, 'wt', encoding='utf-8', newline='')
+        else:
+            out_file = open(out_path, 'w', encoding='utf-8', newline='')
+        try:
+            if out_format == 'csv':
+                writer = csv.writer(out_file)
+                writer.writerow(columns)
+            cursor = conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    row = self.unpack_row(row, columns, compress_dicts)
+                    if out_format == 'csv':
+                        writer.writerow(row)
+                    else:
+                        out_file.write(json.dumps(self.row_to_json(row, columns), ensure_ascii=False))
+                        out_file.write('\n')
+                row_count += len(rows)
+        finally:
+            out_file.close()
+            conn.close()
+        elapsed_time = round(time.time() - start_time, 3)
+        print(f'Exported {row_count} messages to {out_path} in {elapsed_time}s')
+
+    def unpack_row(self, row: tuple, columns: list, compress_dicts: dict) -> list:
+        row = list(row)
+        for i, col in enumerate(columns):
+            if col in compressible_cols and isinstance(row[i], bytes):
+                row[i] = unpack_value(row[i], compress_dicts)
+        return row
+
+    def row_to_json(self, row: list, columns: list) -> dict:
+        row_dict = dict(zip(columns, row))
+        for col in self.json_cols:
+            # JSON columns become nested objects; plain strings (e.g. unknown VK actions) stay as is
+            if isinstance(row_dict.get(col), str):
+                try:
+                    row_dict[col] = json.loads(row_dict[col])
+                except ValueError:
+                    pass
+        return row_dict
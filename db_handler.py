@@ -1,20 +1,81 @@
 import os
+import sqlite3
+import zlib
 from sqlite_utils import Database
 
+def unpack_value(value: bytes, compress_dicts: dict[int, bytes]) -> str:
+    # inverse of DBHandler.compress_value
+    decompressor = zlib.decompressobj(-15, zdict=compress_dicts[value[0]])
+    return (decompressor.decompress(value[1:]) + decompressor.flush()).decode('utf-8')
+
+def read_compress_dicts(conn) -> dict[int, bytes]:
+    # for plain sqlite3 connections (DBReader, DBExporter)
+    compress_dicts = {}
+    table_query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'compress_dicts';"
+    if conn.execute(table_query).fetchone():
+        for dict_id, data in conn.execute('SELECT dict_id, data FROM compress_dicts;'):
+            compress_dicts[dict_id] = data
+    return compress_dicts
+
+def find_missing_indexes(conn) -> list[str]:
+    # for plain sqlite3 connections (DBReader, DBExporter); names as created by sqlite-utils
+    existing = { row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index';") }
+    index_names = [ f'idx_{table}_{"_".join(columns)}' for table, columns in db_indexes ]
+    return [ name for name in index_names if name not in existing ]
+
+def print_index_hint(db_path: str, tool: str):
+    # read-only tools (viewer, export) don't create missing indexes themselves
+    print(f'Note: the database has no indexes, so the {tool} may be slow. '
+          f'Run "mulmes2sqlite.py --create-indexes {db_path}" to add them')
+
+# IDs of messaging services in the data_src columns
+src_dict = {
+    'vk': 1,
+    'tg': 2,
+    'wa': 3 }
+
+# columns that may hold zlib-compressed BLOBs after DBHandler.compact_db()
+compressible_cols = ( 'text', 'attachments', 'fwd_messages', 'service_msg_data' )
+
+# (table, columns) for DBHandler.create_indexes
+db_indexes = [
+    ('usernames', ['orig_id', 'data_src']),
+    ('chats', ['chat_id_orig', 'data_src']),
+    ('messages', ['chat_id', 'msg_id_orig']),
+    ('messages', ['date']),
+    ('messages', ['chat_id', 'date']),
+    ('messages', ['from_id', 'date']) ]
+
 class DBHandler:
     def __init__(self, db_path: str):
         self.db_path = db_path
-        self.src_dict = {
-            'vk': 1,
-            'tg': 2,
-            'wa': 3 }
+        # strings repeated across rows; used as a preset zlib dictionary,
+        # most frequent ones go last
+        self.compress_dict_strs = [
+            'join_group_by_link', 'invite_members', 'remove_members', 'leave_chat',
+            'edit_group_title', 'edit_group_photo', 'pin_message', 'create_group',
+            '"misc": ', '"unknown"', '"money_transfer"', '"market_item"', '"phone_call"',
+            '"photo_album"', '"playlist"', '"story"', '"gift"', '"poll"', '"map"',
+            '"article"', '"wall_comment"', '"wall_post"', '"animation"', '"video_message"',
+            '"voice_message"', '"audio"', '"file"', '"sticker"', '"video"',
+            '<details>', '</details>', '<blockquote>', '</blockquote>', '<tt>', '</tt>',
+            '<s>', '</s>', '<i>', '</i>', '<b>', '</b>', '<a href="https://t.me/',
+            '<a href="https://', '</a>', '"username": ', '"user_id": ', '"title": ',
+            '"members": ', '"from_id_orig": ', '"count": ', '"data": ',
+            '"duration_seconds": ', '"width": ', '"height": ', '"file_name": ',
+            '"media_hash": ', '"file_size": ', '"local_path": ', '"url": "https://vk.com/',
+            '"url": "https://', '"photo"', '[{"type": ' ]
+        self.compress_dicts: dict[int, bytes] = {}
         self.db = Database(db_path)
+        self.db.register_function(self.compress_value, deterministic=True, name='mm_compress')
+        self.db.register_function(self.decompress_value, deterministic=True, name='mm_decompress')
         self.msg_counter = 0
         if not self.db['messages'].exists():
             self.create_db()
             self.init_db_size = 0
         else:
-            self.init_db_size = os.path.getsize(db_path)
+            self.init_db_size = self.get_db_size()
+        self.pre_compact_size = 0
 
     def create_db(self):
         self.db['chats'].create({
@@ -65,6 +126,18 @@ class DBHandler:
             ORDER BY messages.date;
         """)
 
+    def create_plain_view(self):
+        # same columns as 'messages', but with compressed values unpacked;
+        # only usable on connections opened by DBHandler (mm_decompress is a Python function)
+        columns = []
+        for col in self.db['messages'].columns_dict:
+            if col in compressible_cols:
+                columns.append(f'mm_decompress({col}) AS {col}')
+            else:
+                columns.append(col)
+        self.db.create_view('messages_plain',
+            f'SELECT {", ".join(columns)} FROM messages;', replace=True)
+
     def insert_chat_to_db(self, chat_obj: dict, data_src: str):
         msg_list = chat_obj['msg_list']
         self.db['messages'].insert_all(dict( msg.items() ) for msg in msg_list)
@@ -75,32 +148,69 @@ class DBHandler:
             'chat_name': chat_obj['name'],
             'last_msg_date': last_msg['date'],
             'msg_count': len(msg_list),
-            'data_src': self.src_dict[data_src]})
+            'data_src': src_dict[data_src]})
         self.msg_counter += len(msg_list)
 
     def insert_users_to_db(self, usernames_dict: dict[int, str], data_src: str):
         new_users = []
         known_orig_ids = []
         for row in self.db['usernames'].rows:
-            if row['data_src'] == self.src_dict[data_src]:
+            if row['data_src'] == src_dict[data_src]:
                 known_orig_ids.append(row['orig_id'])
         for orig_id, username in usernames_dict.items():
             if orig_id not in known_orig_ids:
                 new_users.append({
                     'name': username,
                     'orig_id': orig_id,
-                    'data_src': self.src_dict[data_src]} )
+                    'data_src': src_dict[data_src]} )
         self.db['usernames'].insert_all(dict( user.items() ) for user in new_users)
 
+    def create_media_tables(self):
+        if not self.db['media'].exists():
+            self.db['media'].create({
+                'media_hash': str, # SHA-256, also stored in attachments
+                'size': int,
+                'mime': str,
+                'first_path': str
+            }, pk='media_hash')
+        if not self.db['media_files'].exists():
+            self.db['media_files'].create({
+                'path': str,
+                'size': int,
+                'mtime': int,
+                'media_hash': str
+            }, pk='path')
+
+    def get_known_media_files(self) -> dict[str, tuple]:
+        known_files = {}
+        for row in self.db['media_files'].rows:
+            known_files[row['path']] = (row['size'], row['mtime'], row['media_hash'])
+        return known_files
+
+    def insert_media_to_db(self, media_rows: list, file_rows: list):
+        # the first indexed copy of each file is kept in 'media'
+        self.db['media'].insert_all(media_rows, pk='media_hash', ignore=True)
+        self.db['media_files'].upsert_all(file_rows, pk='path')
+
+    def create_indexes(self):
+        # speed up update_ids_in_db and DBReader queries (created once, after all inserts)
+        # original IDs are only unique within one data source
+        self.db.execute('DROP INDEX IF EXISTS idx_usernames_orig_id;')
+        self.db.execute('DROP INDEX IF EXISTS idx_chats_chat_id_orig;')
+        for table, columns in db_indexes:
+            self.db[table].create_index(columns, if_not_exists=True)
+
     def update_ids_in_db(self):
         update_from_id_query = """
         UPDATE messages
-        SET from_id = (SELECT user_id FROM usernames WHERE orig_id = messages.from_id_orig)
+        SET from_id = (SELECT user_id FROM usernames WHERE orig_id = messages.from_id_orig
+        AND data_src = messages.data_src)
         WHERE from_id IS NULL;
         """
         update_chat_id_query = """
         UPDATE messages
-        SET chat_id = (SELECT chat_id FROM chats WHERE chat_id_orig = messages.chat_id_orig)
+        SET chat_id = (SELECT chat_id FROM chats WHERE chat_id_orig = messages.chat_id_orig
+        AND data_src = messages.data_src)
         WHERE chat_id IS NULL;
         """
         update_reply_to_id_query = """
@@ -116,3 +226,85 @@ class DBHandler:
             self.db.execute(update_chat_id_query)
             print('Updating message reply IDs...')
             self.db.execute(update_reply_to_id_query)
+
+    def load_compress_dict(self):
+        if not self.db['compress_dicts'].exists():
+            self.db['compress_dicts'].create({
+                'dict_id': int,
+                'data': bytes
+            }, pk='dict_id')
+        for row in self.db['compress_dicts'].rows:
+            self.compress_dicts[row['dict_id']] = row['data']
+        if not self.compress_dicts:
+            zdict = ''.join(self.compress_dict_strs).encode('utf-8')
+            self.db['compress_dicts'].insert({'dict_id': 1, 'data': zdict})
+            self.compress_dicts[1] = zdict
+
+    def compress_value(self, value):
+        # BLOB layout: 1 byte dictionary ID + raw deflate stream
+        if not isinstance(value, str) or not self.compress_dicts:
+            return value
+        dict_id = max(self.compress_dicts)
+        raw = value.encode('utf-8')
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=self.compress_dicts[dict_id])
+        packed = bytes([dict_id]) + compressor.compress(raw) + compressor.flush()
+        return packed if len(packed) < len(raw) else value
+
+    def decompress_value(self, value):
+        if not isinstance(value, bytes) or not value:
+            return value
+        if not self.compress_dicts:
+            self.load_compress_dict()
+        return unpack_value(value, self.compress_dicts)
+
+    def compact_db(self, min_length: int = 48, page_size: int = 8192) -> bool:
+        # page_size can't be changed in WAL mode, and leaving it needs the only connection
+        # to the DB, so this is checked before any value is changed
+        try:
+            journal_mode = self.db.execute('PRAGMA journal_mode = DELETE;').fetchone()[0]
+        except sqlite3.OperationalError as e:
+            journal_mode = str(e)
+        if journal_mode.lower() != 'delete':
+            print(f'Error: can\'t compact the database ({journal_mode}). '
+                  f'Close the viewer and other programs using it and try again')
+            return False
+        self.pre_compact_size = self.get_db_size()
+        self.load_compress_dict()
+        print('Compressing long text and JSON values...')
+        with self.db.conn:
+            for col in compressible_cols:
+                self.db.execute(f"""
+                UPDATE messages SET {col} = mm_compress({col})
+                WHERE typeof({col}) = 'text' AND length({col}) >= ?;
+                """, [min_length])
+        self.create_plain_view()
+        print(f'Running VACUUM (page_size={page_size})...')
+        self.db.execute(f'PRAGMA page_size = {int(page_size)};')
+        try:
+            self.db.vacuum()
+        except sqlite3.OperationalError as e:
+            # values are already compressed; running --compact again only repeats VACUUM
+            print(f'Error running VACUUM: {e}. Run --compact again to reclaim free space')
+            return False
+        return True
+
+    def get_db_size(self) -> int:
+        # a DB opened in WAL mode (e.g. by the viewer) may keep recent pages in the -wal file
+        wal_path = self.db_path + '-wal'
+        wal_size = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+        return os.path.getsize(self.db_path) + wal_size
+
+    def print_db_size(self):
+        db_size = self.get_db_size()
+        print(f'Database size: {self.size_change_str(self.pre_compact_size, db_size)}')
+        # when compacting right after an import, report the growth since start separately,
+        # so it doesn't hide the savings
+        if self.init_db_size and self.init_db_size != self.pre_compact_size:
+            print(f'Since start: {self.size_change_str(self.init_db_size, db_size)}')
+
+    def size_change_str(self, old_size: int, new_size: int) -> str:
+        size_str = f'{new_size / 2**20:.2f} MiB'
+        if old_size:
+            change = (new_size - old_size) / old_size * 100
+            size_str = f'{old_size / 2**20:.2f} MiB -> {size_str} ({change:+.1f}%)'
+        return size_str
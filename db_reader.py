@@ -0,0 +1,178 @@
+import os
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from db_handler import compressible_cols, find_missing_indexes, read_compress_dicts, unpack_value
+
+class DBReader:
+    def __init__(self, db_path: str, pool_size: int = 4, cache_size: int = 256):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self.page_cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.cache_token = None
+        self.compress_dicts: dict[int, bytes] = {}
+        self.db_uri = f'file:{os.path.abspath(db_path)}?mode=rw' # doesn't create a missing file
+        self.enable_wal()
+        self.pool = queue.Queue()
+        for _ in range(pool_size):
+            self.pool.put(self.open_connection())
+        with self.connection() as conn:
+            self.compress_dicts = read_compress_dicts(conn)
+            self.missing_indexes = find_missing_indexes(conn)
+
+    # fixed SQL strings, so each pooled connection prepares them only once
+    msg_columns = """
+        messages.msg_id, messages.chat_id, messages.date,
+        messages.from_id, usernames.name AS from_name,
+        messages.text, messages.attachments, messages.fwd_messages,
+        messages.is_service_msg, messages.service_msg_data,
+        messages.edited, messages.has_formatting, messages.reply_to_id,
+        messages.data_src
+        FROM messages
+        LEFT JOIN usernames ON messages.from_id = usernames.user_id
+        """
+    queries = {
+        'chats': """
+            SELECT chat_id, chat_name, peer_type, msg_count, last_msg_date, data_src
+            FROM chats ORDER BY last_msg_date DESC;
+            """,
+        'history_latest': f"""
+            SELECT {msg_columns}
+            WHERE messages.chat_id = ?
+            ORDER BY messages.date DESC, messages.msg_id DESC LIMIT ?;
+            """,
+        'history_before': f"""
+            SELECT {msg_columns}
+            WHERE messages.chat_id = ? AND (messages.date, messages.msg_id) < (?, ?)
+            ORDER BY messages.date DESC, messages.msg_id DESC LIMIT ?;
+            """,
+        'history_after': f"""
+            SELECT {msg_columns}
+            WHERE messages.chat_id = ? AND (messages.date, messages.msg_id) > (?, ?)
+            ORDER BY messages.date, messages.msg_id LIMIT ?;
+            """,
+        'senders': """
+            SELECT user_id, name, orig_id, data_src
+            FROM usernames WHERE name LIKE ? ORDER BY name LIMIT ?;
+            """,
+        'sender_messages': f"""
+            SELECT {msg_columns}
+            WHERE messages.from_id = ? AND (messages.date, messages.msg_id) > (?, ?)
+            ORDER BY messages.date, messages.msg_id LIMIT ?;
+            """,
+        'date_range': f"""
+            SELECT {msg_columns}
+            WHERE messages.date BETWEEN ? AND ?
+            AND (messages.date, messages.msg_id) > (?, ?)
+            ORDER BY messages.date, messages.msg_id LIMIT ?;
+            """,
+        'date_range_chat': f"""
+            SELECT {msg_columns}
+            WHERE messages.chat_id = ? AND messages.date BETWEEN ? AND ?
+            AND (messages.date, messages.msg_id) > (?, ?)
+            ORDER BY messages.date, messages.msg_id LIMIT ?;
+            """,
+        }
+
+    def enable_wal(self):
+        # readers in WAL mode don't block (and aren't blocked by) an import;
+        # the mode is stored in the DB file, so it stays until --compact switches it back
+        conn = sqlite3.connect(self.db_uri, uri=True)
+        try:
+            if conn.execute('PRAGMA journal_mode;').fetchone()[0] != 'wal':
+                conn.execute('PRAGMA journal_mode = WAL;')
+                print('Switched the database to WAL mode (needed for reading during imports)')
+        except sqlite3.OperationalError as e:
+            print(f'Could not enable WAL mode: {e}')
+        finally:
+            conn.close()
+
+    def open_connection(self) -> sqlite3.Connection:
+        # writes are blocked by query_only (mode=ro would fail
+        # on a WAL database without its -shm file)
+        conn = sqlite3.connect(self.db_uri, uri=True, check_same_thread=False,
+            cached_statements=len(self.queries) * 2)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA query_only = ON;')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self.pool.get()
+        try:
+            yield conn
+        finally:
+            self.pool.put(conn)
+
+    def close(self):
+        while not self.pool.empty():
+            self.pool.get().close()
+
+    def get_cache_token(self) -> tuple:
+        # any import or compaction changes the DB file or its WAL file
+        token = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            try:
+                stat = os.stat(path)
+                token.append( (stat.st_mtime_ns, stat.st_size) )
+            except FileNotFoundError:
+                token.append(None)
+        return tuple(token)
+
+    def cached_query(self, query_name: str, params: tuple) -> list:
+        cache_key = (query_name, params)
+        token = self.get_cache_token()
+        with self.cache_lock:
+            if token != self.cache_token:
+                self.page_cache.clear()
+                self.cache_token = token
+            elif cache_key in self.page_cache:
+                self.page_cache.move_to_end(cache_key)
+                return self.page_cache[cache_key]
+        with self.connection() as conn:
+            rows = [ self.row_to_dict(row, conn) for row in conn.execute(self.queries[query_name], params) ]
+        with self.cache_lock:
+            self.page_cache[cache_key] = rows
+            if len(self.page_cache) > self.cache_size:
+                self.page_cache.popitem(last=False)
+        return rows
+
+    def row_to_dict(self, row: sqlite3.Row, conn: sqlite3.Connection) -> dict:
+        row_dict = dict(row)
+        for col in compressible_cols:
+            value = row_dict.get(col)
+            if isinstance(value, bytes):
+                if value[0] not in self.compress_dicts: # DB was compacted after the viewer started
+                    self.compress_dicts = read_compress_dicts(conn)
+                row_dict[col] = unpack_value(value, self.compress_dicts)
+        return row_dict
+
+    def get_chats(self) -> list:
+        return self.cached_query('chats', ())
+
+    def get_chat_history(self, chat_id: int, before: tuple = None, after: tuple = None,
+                         limit: int = 50) -> list:
+        # before/after are (date, msg_id) keys of the first/last message of a loaded page
+        if after:
+            return self.cached_query('history_after', (chat_id, *after, limit))
+        if before:
+            rows = self.cached_query('history_before', (chat_id, *before, limit))
+        else:
+            rows = self.cached_query('history_latest', (chat_id, limit))
+        return rows[::-1] # always return messages in chronological order
+
+    def find_senders(self, name: str, limit: int = 50) -> list:
+        return self.cached_query('senders', (f'%{name}%', limit))
+
+    def get_sender_messages(self, user_id: int, after: tuple = (-1, -1), limit: int = 50) -> list:
+        return self.cached_query('sender_messages', (user_id, *after, limit))
+
+    def get_messages_by_date(self, start_date: int, end_date: int, chat_id: int = None,
+                             after: tuple = (-1, -1), limit: int = 50) -> list:
+        if chat_id is None:
+            return self.cached_query('date_range', (start_date, end_date, *after, limit))
+        return self.cached_query('date_range_chat', (chat_id, start_date, end_date, *after, limit))
@@ -0,0 +1,153 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from db_handler import print_index_hint
+from db_reader import DBReader
+
+viewer_html = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>mulmes2sqlite viewer</title>
+<style>
+body { display: flex; margin: 0; height: 100vh; font-family: sans-serif; }
+#chats { width: 300px; overflow-y: auto; border-right: 1px solid #ccc; }
+#chats div { padding: 6px 10px; cursor: pointer; }
+#chats div:hover { background: #eee; }
+#history { flex: 1; overflow-y: auto; padding: 0 10px; }
+.msg { margin: 6px 0; white-space: pre-wrap; }
+.meta { color: #888; font-size: 0.85em; }
+</style>
+</head>
+<body>
+<div id="chats"></div>
+<div id="history"></div>
+<script>
+let chatId = null, firstKey = null, loading = false;
+const historyDiv = document.getElementById('history');
+
+function renderMsg(m) {
+    const div = document.createElement('div');
+    div.className = 'msg';
+    const meta = document.createElement('div');
+    meta.className = 'meta';
+    meta.textContent = (m.from_name || '') + ', ' + new Date(m.date * 1000).toLocaleString();
+    const text = document.createElement('div');
+    text.textContent = m.text || '';
+    if (m.attachments) text.textContent += '\\n[' + m.attachments + ']';
+    div.append(meta, text);
+    return div;
+}
+
+async function loadPage() {
+    if (loading) return;
+    loading = true;
+    let url = '/api/chats/' + chatId + '/messages';
+    if (firstKey) url += '?before_date=' + firstKey[0] + '&before_id=' + firstKey[1];
+    const msgs = await (await fetch(url)).json();
+    if (msgs.length) {
+        firstKey = [msgs[0].date, msgs[0].msg_id];
+        const oldHeight = historyDiv.scrollHeight;
+        historyDiv.prepend(...msgs.map(renderMsg));
+        historyDiv.scrollTop += historyDiv.scrollHeight - oldHeight;
+    }
+    loading = false;
+}
+
+async function openChat(id) {
+    chatId = id; firstKey = null;
+    historyDiv.replaceChildren();
+    await loadPage();
+    historyDiv.scrollTop = historyDiv.scrollHeight;
+}
+
+historyDiv.addEventListener('scroll', () => { if (historyDiv.scrollTop < 100) loadPage(); });
+
+fetch('/api/chats').then(r => r.json()).then(chats => {
+    const list = document.getElementById('chats');
+    for (const c of chats) {
+        const div = document.createElement('div');
+        div.textContent = c.chat_name + ' (' + c.msg_count + ')';
+        div.onclick = () => openChat(c.chat_id);
+        list.append(div);
+    }
+});
+</script>
+</body>
+</html>
+"""
+
+class ViewerRequestHandler(BaseHTTPRequestHandler):
+    db_reader: DBReader = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        path_parts = url.path.strip('/').split('/')
+        try:
+            if url.path == '/':
+                self.send_body(viewer_html.encode('utf-8'), 'text/html; charset=utf-8')
+                return
+            if path_parts[0] != 'api':
+                self.send_error(404)
+                return
+            data = self.handle_api(path_parts[1:], params)
+            if data is None:
+                self.send_error(404)
+            else:
+                self.send_json(data)
+        except (KeyError, ValueError) as e:
+            self.send_error(400, str(e))
+
+    def handle_api(self, path_parts: list, params: dict):
+        reader = self.db_reader
+        limit = max(1, min(int(params.get('limit', 50)), 500))
+        after = (int(params.get('after_date', -1)), int(params.get('after_id', -1)))
+        if path_parts == ['chats']:
+            return reader.get_chats()
+        if len(path_parts) == 3 and path_parts[0] == 'chats' and path_parts[2] == 'messages':
+            chat_id = int(path_parts[1])
+            before = None
+            if 'before_date' in params:
+                before = (int(params['before_date']), int(params['before_id']))
+            if 'after_date' not in params:
+                after = None
+            return reader.get_chat_history(chat_id, before, after, limit)
+        if path_parts == ['senders']:
+            return reader.find_senders(params.get('name', ''), limit)
+        if len(path_parts) == 3 and path_parts[0] == 'senders' and path_parts[2] == 'messages':
+            return reader.get_sender_messages(int(path_parts[1]), after, limit)
+        if path_parts == ['messages']:
+            chat_id = int(params['chat_id']) if 'chat_id' in params else None
+            return reader.get_messages_by_date(int(params['start']), int(params['end']),
+                chat_id, after, limit)
+        return None
+
+    def send_json(self, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_body(body, 'application/json; charset=utf-8')
+
+    def send_body(self, body: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def run_viewer(db_path: str, port: int):
+    ViewerRequestHandler.db_reader = DBReader(db_path)
+    if ViewerRequestHandler.db_reader.missing_indexes: # DBs created by older versions
+        print_index_hint(db_path, 'viewer')
+    server = ThreadingHTTPServer(('127.0.0.1', port), ViewerRequestHandler)
+    print(f'Viewer is running at http://127.0.0.1:{port}/ (press Ctrl+C to stop)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        ViewerRequestHandler.db_reader.close()
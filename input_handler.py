@@ -1,7 +1,22 @@
 import glob
 import io
 import os
+import queue
+import threading
+import time
 import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import multiprocessing
+    # other threads (prefetch readers, other sources with -s) may be running when
+    # the pool starts, and forking a multithreaded process can deadlock the children
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    mp_context = multiprocessing.get_context(start_method)
+    MP_ENABLED = True
+except:
+    MP_ENABLED = False
 
 class InputHandler:
     def __init__(self, input_path: str, encoding: str, target_ext: str):
@@ -13,6 +28,26 @@ class InputHandler:
             self.dir_mode = True
         elif zipfile.is_zipfile(input_path):
             self.zip_mode = True
+        self.read_ahead = 16 # files
+        self.read_ahead_mem = 256 * 2**20 # bytes
+        self.read_wait_time = 0.0 # time parser workers were idle waiting for input files
+        self.prefetched_count = 0
+        self.pool = None # started by map_files, reused for all chats of the source
+
+    def __getstate__(self):
+        # parsers (and their InputHandler) are pickled with the tasks sent to the pool
+        state = self.__dict__.copy()
+        state['pool'] = None
+        return state
+
+    def close(self):
+        if self.pool:
+            self.pool.terminate()
+            self.pool = None
+
+    def set_read_ahead(self, read_ahead: int, read_ahead_mem: int):
+        self.read_ahead = max(1, read_ahead)
+        self.read_ahead_mem = read_ahead_mem
 
     def get_file_list(self) -> list:
         if self.dir_mode:
@@ -39,3 +74,134 @@ class InputHandler:
         except Exception as e:
             print(f'Error reading file: {e}')
             return ''
+
+    def prefetch(self, file_list: list, worker_count: int = 1):
+        return PrefetchReader(self, file_list, worker_count)
+
+    def map_files(self, worker_func, file_list: list, proc_count: int = 1):
+        # yields worker_func( (filepath, content) ) for every file in order;
+        # files are prefetched in threads, worker_func runs in proc_count processes.
+        # Starting a pool takes a while (workers re-import the program), so it's
+        # kept until close(). Closing the reader on errors ends the pool's task
+        # feeder, which would otherwise wait for the next prefetched file forever
+        if proc_count != 1 and not self.pool:
+            self.pool = mp_context.Pool(proc_count)
+        with self.prefetch(file_list, proc_count) as files:
+            if self.pool:
+                results = self.pool.imap(worker_func, files)
+            else:
+                results = map(worker_func, files)
+            for result in results:
+                files.release()
+                yield result
+
+# Reads and decodes files from file_list in background threads, keeping up to
+# InputHandler.read_ahead files (and about read_ahead_mem bytes) ahead of the parser.
+# Iterating yields (filepath, content) tuples in the original order; release()
+# must be called once for every processed file to let the read-ahead continue.
+class PrefetchReader:
+    def __init__(self, inp: InputHandler, file_list: list, worker_count: int):
+        self.inp = inp
+        self.file_list = file_list
+        self.worker_count = worker_count
+        self.cond = threading.Condition()
+        self.held_count, self.held_bytes = 0, 0 # files read or being read, not released yet
+        self.held_sizes = deque()
+        # a wait for the next file counts as input wait time only from the moment
+        # fewer files than workers are handed out, i.e. some parser worker is idle;
+        # before that it's just back-pressure from busy workers
+        self.waiting = False
+        self.starving_since = None
+        self.closed = False
+        self.futures = queue.Queue()
+        self.zip_local = threading.local()
+        self.zip_objects = []
+        self.executor = ThreadPoolExecutor(max_workers=min(inp.read_ahead, 8))
+        self.scheduler = threading.Thread(target=self.schedule_reads, daemon=True)
+        self.scheduler.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.file_list)
+
+    def __iter__(self):
+        for _ in self.file_list:
+            with self.cond:
+                self.waiting = True
+                if len(self.held_sizes) < self.worker_count:
+                    self.starving_since = time.perf_counter()
+            future = self.get_next_future()
+            if future is None: # closed, e.g. after an error in a parser worker
+                return
+            filepath, content, size = future.result()
+            with self.cond:
+                self.waiting = False
+                if self.starving_since is not None:
+                    self.inp.read_wait_time += time.perf_counter() - self.starving_since
+                    self.starving_since = None
+                self.held_sizes.append(size)
+            self.inp.prefetched_count += 1
+            yield filepath, content
+
+    def get_next_future(self):
+        # may run in the task feeder thread of multiprocessing.Pool,
+        # so it must not block forever once the reader is closed
+        while not self.closed:
+            try:
+                return self.futures.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def schedule_reads(self):
+        for filepath in self.file_list:
+            with self.cond:
+                # always allow one file, so a single huge file can't block the reader
+                self.cond.wait_for(lambda: self.closed or self.held_count == 0 or (
+                    self.held_count < self.inp.read_ahead
+                    and self.held_bytes < self.inp.read_ahead_mem))
+                if self.closed:
+                    return
+                self.held_count += 1
+                self.futures.put(self.executor.submit(self.read_file, filepath))
+
+    def read_file(self, filepath: str):
+        try:
+            if self.inp.dir_mode:
+                with open(filepath, 'rb') as f:
+                    raw = f.read()
+            else:
+                zip_obj = getattr(self.zip_local, 'zip_obj', None)
+                if not zip_obj: # one handle per thread, so ZIP index is read only once
+                    zip_obj = zipfile.ZipFile(self.inp.input_path, 'r')
+                    self.zip_local.zip_obj = zip_obj
+                    self.zip_objects.append(zip_obj)
+                raw = zip_obj.read(filepath)
+            content = io.TextIOWrapper(io.BytesIO(raw), self.inp.encoding).read()
+        except Exception as e:
+            print(f'Error reading file: {e}')
+            raw, content = b'', ''
+        with self.cond:
+            self.held_bytes += len(raw)
+        return filepath, content, len(raw)
+
+    def release(self):
+        with self.cond:
+            self.held_count -= 1
+            self.held_bytes -= self.held_sizes.popleft()
+            if self.waiting and self.starving_since is None and len(self.held_sizes) < self.worker_count:
+                self.starving_since = time.perf_counter()
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for zip_obj in self.zip_objects:
+            zip_obj.close()
@@ -0,0 +1,145 @@
+import hashlib
+import mimetypes
+import os
+import posixpath
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from input_handler import InputHandler
+
+class MediaIndexer:
+    def __init__(self, known_files: dict[str, tuple], store_dir: str = None):
+        self.known_files = known_files # path -> (size, mtime, media_hash), see DBHandler
+        self.store_dir = store_dir
+        self.executor = ThreadPoolExecutor()
+        self.zip_local = threading.local()
+        self.zip_objects = []
+        self.hashed_count, self.skipped_count = 0, 0
+        self.counter_lock = threading.Lock()
+        self.chunk_size = 2**20
+
+    def close(self):
+        self.executor.shutdown()
+        for zip_obj in self.zip_objects:
+            zip_obj.close()
+
+    def index_chat(self, chat_obj: dict, inp: InputHandler):
+        # adds 'media_hash' to attachments of the chat and stores rows for
+        # DBHandler.insert_media_to_db in chat_obj['media_rows']
+        attachments_by_path = {}
+        for msg in chat_obj['msg_list']:
+            att_lists = [ msg.get('attachments') ]
+            for fwd_msg in msg.get('fwd_messages') or []:
+                att_lists.append(fwd_msg.get('attachments'))
+            for att_list in att_lists:
+                if not isinstance(att_list, list): # VK attachments are JSON strings with URLs
+                    continue
+                for att in att_list:
+                    local_path = att.get('local_path')
+                    if local_path and local_path != 'not_included':
+                        file_path = self.resolve_path(inp, chat_obj['media_dir'], local_path)
+                        attachments_by_path.setdefault(file_path, []).append(att)
+
+        media_rows, file_rows = [], []
+        results = self.executor.map(lambda p: self.index_file(inp, p), attachments_by_path)
+        for file_path, file_info in zip(attachments_by_path, results):
+            if not file_info:
+                continue
+            media_row, file_row = file_info
+            for att in attachments_by_path[file_path]:
+                att['media_hash'] = media_row['media_hash']
+            media_rows.append(media_row)
+            file_rows.append(file_row)
+        chat_obj['media_rows'] = (media_rows, file_rows)
+
+    def resolve_path(self, inp: InputHandler, media_dir: str, local_path: str) -> str:
+        if inp.dir_mode:
+            return os.path.normpath( os.path.join(media_dir, local_path) )
+        return posixpath.normpath( posixpath.join(media_dir, local_path) ) # path inside ZIP
+
+    def index_file(self, inp: InputHandler, file_path: str):
+        try:
+            if inp.dir_mode:
+                stat = os.stat(file_path)
+                size, mtime = stat.st_size, stat.st_mtime_ns
+                full_path = os.path.abspath(file_path)
+            else:
+                zip_info = self.get_zip(inp).getinfo(file_path)
+                size = zip_info.file_size
+                mtime = int( time.mktime(zip_info.date_time + (0, 0, -1)) ) * 10**9
+                full_path = os.path.join(os.path.abspath(inp.input_path), file_path)
+        except (OSError, KeyError):
+            return None # referenced file is missing from the export
+
+        known_file = self.known_files.get(full_path)
+        if known_file and known_file[:2] == (size, mtime):
+            media_hash = known_file[2]
+            with self.counter_lock:
+                self.skipped_count += 1
+        else:
+            media_hash = self.hash_file(inp, file_path)
+            with self.counter_lock:
+                self.hashed_count += 1
+        if self.store_dir:
+            self.store_file(inp, file_path, media_hash)
+
+        media_row = {
+            'media_hash': media_hash,
+            'size': size,
+            'mime': mimetypes.guess_type(file_path)[0],
+            'first_path': full_path}
+        file_row = {
+            'path': full_path,
+            'size': size,
+            'mtime': mtime,
+            'media_hash': media_hash}
+        return media_row, file_row
+
+    def get_zip(self, inp: InputHandler) -> zipfile.ZipFile:
+        # one handle per thread and archive, so ZIP index is read only once
+        if not hasattr(self.zip_local, 'zip_objects'):
+            self.zip_local.zip_objects = {}
+        zip_obj = self.zip_local.zip_objects.get(inp.input_path)
+        if not zip_obj:
+            zip_obj = zipfile.ZipFile(inp.input_path, 'r')
+            self.zip_local.zip_objects[inp.input_path] = zip_obj
+            self.zip_objects.append(zip_obj)
+        return zip_obj
+
+    def open_file(self, inp: InputHandler, file_path: str):
+        if inp.dir_mode:
+            return open(file_path, 'rb')
+        return self.get_zip(inp).open(file_path, 'r')
+
+    def hash_file(self, inp: InputHandler, file_path: str) -> str:
+        sha256 = hashlib.sha256()
+        with self.open_file(inp, file_path) as f:
+            while chunk := f.read(self.chunk_size):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def store_file(self, inp: InputHandler, file_path: str, media_hash: str):
+        # <store_dir>/ab/abcdef....jpg
+        ext = os.path.splitext(file_path)[1].lower()
+        store_path = os.path.join(self.store_dir, media_hash[:2], media_hash + ext)
+        if os.path.exists(store_path):
+            return
+        os.makedirs(os.path.dirname(store_path), exist_ok=True)
+        tmp_path = f'{store_path}.{threading.get_ident()}.tmp'
+        try:
+            if inp.dir_mode:
+                try:
+                    os.link(file_path, tmp_path) # no extra disk space on the same file system
+                except OSError:
+                    shutil.copy2(file_path, tmp_path)
+            else:
+                with self.open_file(inp, file_path) as src, open(tmp_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, self.chunk_size)
+            os.replace(tmp_path, store_path)
+        except OSError as e:
+            print(f'Error storing media file {file_path}: {e}')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -1,22 +1,48 @@
 import argparse
+import datetime
 import os
+import queue
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from vkhtml_parser import VKhtmlParser
 from tgjson_parser import TGjsonParser
+from tghtml_parser import TGhtmlParser
 from db_handler import DBHandler
+from db_viewer import run_viewer
+from db_exporter import DBExporter
+from media_indexer import MediaIndexer
 
 ui_txt = {
     'prog':    "mulmes2sqlite",
     'desc':    "Merge chats from multiple messengers into a single SQLite database",
-    '-p':      "selected data parser (vkhtml, tgjson)",
+    '-p':      "selected data parser (vkhtml, tgjson, tghtml)",
     'bs4b':    "BeautifulSoup4 backend (html.parser or lxml)",
     '-j':      "CPU count (if multiprocessing is available)",
     '-i':      "input directory or ZIP file",
+    'ra':      "number of input files to read ahead of the parser (default: 16)",
+    'ra_mem':  "memory limit for read-ahead files in MB (default: 256)",
+    '-s':      "data source as parser:path (can be repeated, e.g. -s vkhtml:vk.zip -s tgjson:tg/)",
+    'compact': "compress long text/JSON values and VACUUM the database after import "
+               "(compressed values are unreadable in external SQLite tools, use --serve or --export)",
+    'cr_idx':  "create indexes for the web viewer and export (done automatically after import)",
+    'serve':   "start a local web viewer for the database on the given port",
+    'export':  "export messages to a JSONL or CSV file (.gz for gzip compression)",
+    'ex_fmt':  "export format: jsonl or csv (default: by file extension)",
+    'ex_cols': "comma-separated list of exported columns (default: all)",
+    'ex_chat': "export only the chat with the given chat_id (can be repeated)",
+    'ex_src':  "export only messages from the given source (vk, tg)",
+    'ex_since': "export messages starting from this date (YYYY-MM-DD)",
+    'ex_until': "export messages up to this date inclusive (YYYY-MM-DD)",
+    'ex_gzip': "compress the exported file with gzip",
+    'idx_media': "index media files of Telegram exports (hash them and link them from attachments)",
+    'media_st': "copy or hard-link unique media files into this directory (implies --index-media)",
     'db_help': "SQLite database file (will be created if it doesn't exist)",
     'no_pars': "No parser selected",
     'no_inp':  "No valid input found",
+    'bad_src': "Invalid source spec (expected parser:path)",
     'commands_list':
 "Type 'a' to import all chats (default), 's' to select the desired chats,\n'q' to quit",
     'select_chats': "Enter the chats to import (example: 1,3,5)",
@@ -29,36 +55,103 @@ class Mulmes2sqliteCLI:
         argparser.add_argument('--bs4-backend', default='html.parser', help = ui_txt['bs4b'] )
         argparser.add_argument('-j', help = ui_txt['-j'] )
         argparser.add_argument('-i', '--input', help = ui_txt['-i'] )
+        argparser.add_argument('--read-ahead', type=int, default=16, help = ui_txt['ra'] )
+        argparser.add_argument('--read-ahead-mem', type=int, default=256, help = ui_txt['ra_mem'] )
+        argparser.add_argument('-s', '--source', action='append', default=[], help = ui_txt['-s'] )
+        argparser.add_argument('--compact', action='store_true', help = ui_txt['compact'] )
+        argparser.add_argument('--create-indexes', action='store_true', help = ui_txt['cr_idx'] )
+        argparser.add_argument('--serve', metavar='PORT', type=int, help = ui_txt['serve'] )
+        argparser.add_argument('--export', metavar='OUT_FILE', help = ui_txt['export'] )
+        argparser.add_argument('--format', choices=['jsonl', 'csv'], help = ui_txt['ex_fmt'] )
+        argparser.add_argument('--columns', help = ui_txt['ex_cols'] )
+        argparser.add_argument('--chat', type=int, action='append', help = ui_txt['ex_chat'] )
+        argparser.add_argument('--data-src', help = ui_txt['ex_src'] )
+        argparser.add_argument('--since', help = ui_txt['ex_since'] )
+        argparser.add_argument('--until', help = ui_txt['ex_until'] )
+        argparser.add_argument('--gzip', action='store_true', help = ui_txt['ex_gzip'] )
+        argparser.add_argument('--index-media', action='store_true', help = ui_txt['idx_media'] )
+        argparser.add_argument('--media-store', metavar='DIR', help = ui_txt['media_st'] )
         argparser.add_argument('db_file', help = ui_txt['db_help'] )
         args = argparser.parse_args()
 
-        self.selected_parser = args.parser
         self.db_file = args.db_file
-        self.data_parser = None
-        input_path = args.input
-
-        if not self.selected_parser:
-            print(ui_txt['no_pars'])
-        elif self.selected_parser == 'vkhtml':
-            bs4_backend = args.bs4_backend
-            proc_count = int(args.j) if args.j else os.cpu_count() // 2
-            self.data_parser = VKhtmlParser(input_path, bs4_backend, proc_count)
-        elif self.selected_parser == 'tgjson':
-            self.data_parser = TGjsonParser(input_path)
-        else:
-            print(f'Error: unknown parser {self.selected_parser}')
+        self.compact = args.compact
+        self.index_media = args.index_media or bool(args.media_store)
+        self.media_store = args.media_store
+        self.media_indexer = None
+        self.cancel_parsing = threading.Event()
+        self.bs4_backend = args.bs4_backend
+        self.proc_count = int(args.j) if args.j else os.cpu_count() // 2
+        self.read_ahead = (args.read_ahead, args.read_ahead_mem * 2**20)
+        source_specs = []
+        if args.parser:
+            source_specs.append( (args.parser, args.input) )
+        for spec in args.source:
+            if ':' not in spec:
+                print(f"{ui_txt['bad_src']}: {spec}")
+                continue
+            source_specs.append( tuple(spec.split(':', 1)) )
+
+        self.sources = []
+        for selected_parser, input_path in source_specs:
+            data_parser = self.create_parser(selected_parser, input_path)
+            if data_parser:
+                data_parser.inp.set_read_ahead(*self.read_ahead)
+                self.sources.append( (selected_parser, data_parser) )
+
+        if not source_specs:
+            if args.create_indexes or self.compact:
+                dbhandler = DBHandler(self.db_file)
+                if args.create_indexes:
+                    dbhandler.create_indexes()
+                if self.compact:
+                    self.compact_db(dbhandler)
+            elif not args.serve and not args.export:
+                print(ui_txt['no_pars'])
+        elif self.sources:
+            self.scan_sources()
+
+        if args.export:
+            if os.path.isfile(self.db_file):
+                self.export_db(args)
+            else:
+                print(f'Error: database file {self.db_file} not found')
+
+        if args.serve:
+            if os.path.isfile(self.db_file):
+                run_viewer(self.db_file, args.serve)
+            else:
+                print(f'Error: database file {self.db_file} not found')
 
-        if self.data_parser:
-            self.scan_input_path()
+    def create_parser(self, selected_parser: str, input_path: str):
+        if selected_parser == 'vkhtml':
+            return VKhtmlParser(input_path, self.bs4_backend, self.proc_count)
+        elif selected_parser == 'tgjson':
+            return TGjsonParser(input_path)
+        elif selected_parser == 'tghtml':
+            return TGhtmlParser(input_path, self.proc_count)
+        print(f'Error: unknown parser {selected_parser}')
+        return None
 
-    def scan_input_path(self):
-        data_entries_list = self.data_parser.create_data_entries()
+    def scan_sources(self):
+        parse_jobs = []
+        for selected_parser, data_parser in self.sources:
+            if len(self.sources) > 1:
+                print(f'Source {selected_parser}: {data_parser.inp.input_path}')
+            data_entries_list = self.scan_input_path(data_parser)
+            if data_entries_list:
+                parse_jobs.append( (selected_parser, data_parser, data_entries_list) )
+        if parse_jobs:
+            self.parse_chats(parse_jobs)
+
+    def scan_input_path(self, data_parser) -> list:
+        data_entries_list = data_parser.create_data_entries()
         if data_entries_list:
-            self.ask_user_before_parsing(data_entries_list)
-        else:
-            print(ui_txt['no_inp'])
+            return self.ask_user_before_parsing(data_entries_list)
+        print(ui_txt['no_inp'])
+        return []
 
-    def ask_user_before_parsing(self, data_entries_list: list):
+    def ask_user_before_parsing(self, data_entries_list: list) -> list:
         chats_total = sum(d['chat_count'] for d in data_entries_list)
         print(f'Found {chats_total} chats:')
         for i, data_entry in enumerate(data_entries_list):
@@ -67,37 +160,116 @@ class Mulmes2sqliteCLI:
         while True:
             user_answer = input('> ')
             if not user_answer or user_answer == 'a':
-                self.parse_chats(data_entries_list)
-                break
+                return data_entries_list
             if user_answer == 's':
-                self.select_chats(data_entries_list)
-                break
+                return self.select_chats(data_entries_list)
             if user_answer == 'q':
                 sys.exit()
             else:
                 print(f'Unknown command: {user_answer}')
 
-    def parse_chats(self, data_entries_list: list):
+    def parse_chats(self, parse_jobs: list):
+        # sources are parsed concurrently, but only this thread writes to the DB
         dbhandler = DBHandler(self.db_file)
-        data_src = self.selected_parser[:2]
+        if self.index_media:
+            dbhandler.create_media_tables()
+            known_files = dbhandler.get_known_media_files()
+            self.media_indexer = MediaIndexer(known_files, self.media_store)
+        chat_queue = queue.Queue(maxsize=4)
         start_time = time.time()
-        for i, data_entry in enumerate(data_entries_list):
-            data_name = data_entry['name']
-            print(f'[{i+1}/{len(data_entries_list)}] Processing {data_name}')
-            parser_output = self.data_parser.process_data_entry(data_entry)
-            for chat_obj in parser_output:
-                dbhandler.insert_chat_to_db(chat_obj, data_src)
+        with ThreadPoolExecutor(max_workers=len(parse_jobs)) as executor:
+            futures = [ executor.submit(self.parse_source, job, chat_queue) for job in parse_jobs ]
+            sources_left = len(parse_jobs)
+            try:
+                while sources_left:
+                    queue_item = chat_queue.get()
+                    if queue_item is None: # source finished
+                        sources_left -= 1
+                    else:
+                        dbhandler.insert_chat_to_db(*queue_item)
+                        chat_obj = queue_item[0]
+                        if chat_obj.get('media_rows'):
+                            dbhandler.insert_media_to_db(*chat_obj['media_rows'])
+            except BaseException:
+                # stop the sources and unblock those waiting on a full queue,
+                # otherwise the executor never shuts down
+                self.cancel_parsing.set()
+                while sources_left:
+                    if chat_queue.get() is None:
+                        sources_left -= 1
+                raise
+        # chats of the other sources are already written, so their users and IDs
+        # are still processed below before the error is raised
+        failed_jobs = [ (job, f.exception()) for job, f in zip(parse_jobs, futures) if f.exception() ]
 
         elapsed_time = round(time.time() - start_time, 3)
         print(f'Inserted {dbhandler.msg_counter} messages in {elapsed_time}s')
+        if self.media_indexer:
+            self.media_indexer.close()
+            hashed, skipped = self.media_indexer.hashed_count, self.media_indexer.skipped_count
+            print(f'Indexed media files: {hashed} hashed, {skipped} unchanged since last import')
+        for selected_parser, data_parser, _ in parse_jobs:
+            inp = data_parser.inp
+            if inp.prefetched_count:
+                wait_time = round(inp.read_wait_time, 3)
+                print(f'{selected_parser}: parser workers waited {wait_time}s for {inp.prefetched_count} input files')
 
         print('Processing user IDs and chat IDs...')
-        dbhandler.insert_users_to_db(self.data_parser.usernames_dict, data_src)
+        for selected_parser, data_parser, _ in parse_jobs:
+            dbhandler.insert_users_to_db(data_parser.usernames_dict, selected_parser[:2])
+        dbhandler.create_indexes()
         dbhandler.update_ids_in_db()
+        if failed_jobs:
+            for (selected_parser, data_parser, _), error in failed_jobs:
+                print(f'Error: {selected_parser} import from {data_parser.inp.input_path} failed: {error!r}')
+            raise failed_jobs[0][1]
+        if self.compact:
+            self.compact_db(dbhandler)
         elapsed_time = round(time.time() - start_time, 3)
         print(f'Done! Total time spent: {elapsed_time}s')
 
-    def select_chats(self, data_entries_list: list):
+    def export_db(self, args):
+        try:
+            start_date, end_date = None, None
+            if args.since:
+                start_date = datetime.datetime.strptime(args.since, '%Y-%m-%d')
+                start_date = int(start_date.timestamp())
+            if args.until:
+                end_date = datetime.datetime.strptime(args.until, '%Y-%m-%d')
+                end_date = int( (end_date + datetime.timedelta(days=1)).timestamp() )
+        except ValueError as e:
+            print(f'Error parsing date: {e}')
+            return
+        columns = args.columns.split(',') if args.columns else None
+        exporter = DBExporter(self.db_file)
+        exporter.export(args.export, args.format, columns, args.chat, args.data_src,
+            start_date, end_date, args.gzip)
+
+    def compact_db(self, dbhandler: DBHandler):
+        if dbhandler.compact_db():
+            dbhandler.print_db_size()
+
+    def parse_source(self, parse_job: tuple, chat_queue: queue.Queue):
+        selected_parser, data_parser, data_entries_list = parse_job
+        data_src = selected_parser[:2]
+        try:
+            for i, data_entry in enumerate(data_entries_list):
+                if self.cancel_parsing.is_set():
+                    break
+                data_name = data_entry['name']
+                print(f'[{selected_parser} {i+1}/{len(data_entries_list)}] Processing {data_name}')
+                parser_output = data_parser.process_data_entry(data_entry)
+                for chat_obj in parser_output:
+                    if self.cancel_parsing.is_set():
+                        break
+                    if self.media_indexer and chat_obj.get('media_dir') is not None:
+                        self.media_indexer.index_chat(chat_obj, data_parser.inp)
+                    chat_queue.put( (chat_obj, data_src) )
+        finally:
+            data_parser.inp.close() # stops parser processes
+            chat_queue.put(None)
+
+    def select_chats(self, data_entries_list: list) -> list:
         new_data_entries_list = []
         print(ui_txt['select_chats'])
         user_input = input('> ')
@@ -111,7 +283,7 @@ class Mulmes2sqliteCLI:
 
         for i in selected_indexes:
             new_data_entries_list.append(data_entries_list[i-1])
-        self.parse_chats(new_data_entries_list)  
+        return new_data_entries_list
 
 if __name__ == "__main__":
     cli_interface = Mulmes2sqliteCLI()
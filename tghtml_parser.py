@@ -0,0 +1,377 @@
+import datetime
+import os
+import posixpath
+import re
+import zlib
+from html.parser import HTMLParser
+from tqdm import tqdm
+
+from input_handler import MP_ENABLED, InputHandler
+
+# HTML export doesn't contain user and chat IDs, so they are derived from names
+# and moved out of the range of real Telegram IDs
+SYNTHETIC_ID_BASE = 10**12
+
+def synthetic_id(name: str) -> int:
+    return SYNTHETIC_ID_BASE + zlib.crc32(name.encode('utf-8'))
+
+class TGhtmlPageParser(HTMLParser):
+    # event-driven parser for a single messages*.html file (no DOM is built)
+    void_tags = ('br', 'img', 'hr', 'input', 'meta', 'link', 'source', 'wbr')
+
+    def __init__(self, conf: dict):
+        super().__init__(convert_charrefs=True)
+        self.conf = conf
+        self.chat_name = ''
+        self.msg_list = []
+        self.users_subset = {}
+        self.stack = [] # (tag, role) of open elements
+        self.msg = None
+        self.part = None # message itself or its forwarded part
+        self.text_buf = None
+        self.link_starts = []
+        self.capture = None # 'chat_name', 'from_name' or 'service'
+        self.capture_buf = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        role = None
+        if self.text_buf is not None:
+            role = self.start_formatting(tag, attrs, classes)
+        elif tag == 'div' and 'message' in classes:
+            role = self.start_message(attrs, classes)
+        elif self.msg is None:
+            if tag == 'div' and 'text' in classes and 'bold' in classes and not self.chat_name:
+                role = self.start_capture('chat_name')
+        elif self.msg['is_service_msg'] and tag == 'div' and 'body' in classes:
+            role = self.start_capture('service')
+        elif tag == 'div' and 'forwarded' in classes and 'body' in classes: # not 'userpic_wrap'
+            self.part = {'text': '', 'attachments': None, 'from_name': ''}
+            role = 'forwarded'
+        elif tag == 'div' and 'date' in classes and 'details' in classes and not self.msg['date']:
+            self.msg['date'] = self.parse_date(attrs.get('title', ''))
+        elif tag == 'div' and 'from_name' in classes:
+            role = self.start_capture('from_name')
+        elif tag == 'a' and 'GoToMessage' in (attrs.get('onclick') or ''):
+            self.msg['reply_to_id_orig'] = int(re.search(r'\d+', attrs['onclick']).group())
+        elif tag == 'div' and 'text' in classes:
+            self.text_buf, self.link_starts = [], []
+            role = 'text'
+        elif tag in ('a', 'div') and not self.part.get('attachments'):
+            self.parse_media(tag, attrs, classes)
+        if tag not in self.void_tags:
+            self.stack.append( (tag, role) )
+
+    def handle_endtag(self, tag):
+        if tag in self.void_tags:
+            return
+        while self.stack:
+            open_tag, role = self.stack.pop()
+            if role:
+                self.end_role(role)
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.text_buf is not None:
+            self.text_buf.append(data)
+        # skip nested elements, e.g. date of a forwarded message inside from_name;
+        # service messages keep link text ('X pinned this message')
+        elif self.capture and (self.capture == 'service' or self.stack[-1][1] == self.capture):
+            self.capture_buf.append(data)
+
+    def start_message(self, attrs: dict, classes: list):
+        msg_id = int( (attrs.get('id') or 'message-1')[len('message'):] )
+        if msg_id < 0: # date separator
+            return None
+        self.msg = {
+            'msg_id_orig': msg_id,
+            'from_name': None, # None means "same sender as previous message"
+            'date': 0,
+            'text': '',
+            'attachments': None,
+            'is_service_msg': int('service' in classes),
+            'service_msg_data': None,
+            'edited': 0,
+            'has_formatting': 0,
+            'reply_to_id_orig': None,
+            'data_src': 2}
+        self.part = self.msg
+        return 'message'
+
+    def start_capture(self, capture: str):
+        self.capture, self.capture_buf = capture, []
+        return capture
+
+    def start_formatting(self, tag: str, attrs: dict, classes: list):
+        if tag == 'br':
+            self.text_buf.append('\n')
+            return None
+        html_tag = self.conf['formatted_tags'].get(tag)
+        if tag == 'span' and 'spoiler' in classes:
+            html_tag = 'details'
+        if html_tag:
+            self.part['has_formatting'] = 1
+            self.text_buf.append(f'<{html_tag}>')
+            return 'fmt_' + html_tag
+        if tag == 'a':
+            self.link_starts.append( (len(self.text_buf), attrs) )
+            return 'link'
+        if tag == 'u':
+            self.part['has_formatting'] = 1
+        return None
+
+    def end_role(self, role: str):
+        if role.startswith('fmt_'):
+            self.text_buf.append(f'</{role[4:]}>')
+        elif role == 'link':
+            self.end_link()
+        elif role == 'text':
+            self.part['text'] = ''.join(self.text_buf).strip()
+            self.text_buf = None
+        elif role == 'forwarded':
+            self.end_forwarded()
+        elif role == 'message':
+            self.end_message()
+        elif role == self.capture:
+            self.end_capture()
+
+    def end_link(self):
+        start, attrs = self.link_starts.pop()
+        txt = ''.join(self.text_buf[start:])
+        href = attrs.get('href') or ''
+        onclick = attrs.get('onclick') or ''
+        if not href or onclick: # hashtags, bot commands etc. are plain text in tgjson
+            return
+        self.part['has_formatting'] = 1
+        del self.text_buf[start:]
+        self.text_buf.append(f'<a href="{href}">{txt}</a>')
+
+    def end_capture(self):
+        captured = ' '.join(''.join(self.capture_buf).split())
+        if self.capture == 'chat_name':
+            self.chat_name = captured
+        elif self.capture == 'from_name':
+            self.part['from_name'] = captured
+        elif self.capture == 'service':
+            self.parse_service_msg(captured)
+        self.capture = None
+
+    def end_forwarded(self):
+        fwd_part = self.part
+        self.part = self.msg
+        fwd_name = fwd_part['from_name'] or 'DELETED'
+        fwd_from_id = synthetic_id(fwd_name)
+        self.users_subset[fwd_from_id] = fwd_name
+        self.msg['fwd_messages'] = [ {
+            'from_id_orig': fwd_from_id,
+            'text': fwd_part['text'],
+            'attachments': fwd_part['attachments']} ]
+        if fwd_part.get('has_formatting'):
+            self.msg['has_formatting'] = 1
+
+    def end_message(self):
+        msg = self.msg
+        self.msg, self.part = None, None
+        from_name = msg.pop('from_name')
+        if from_name is not None:
+            msg['from_id_orig'] = synthetic_id(from_name)
+            self.users_subset[msg['from_id_orig']] = from_name
+        else:
+            msg['from_id_orig'] = None
+        self.msg_list.append(msg)
+
+    def parse_date(self, date_str: str) -> int:
+        # e.g. '14.08.2023 12:17:29 UTC+03:00' (older exports have no UTC offset)
+        try:
+            parts = date_str.split()
+            date = datetime.datetime.strptime(' '.join(parts[:2]), '%d.%m.%Y %H:%M:%S')
+            if len(parts) > 2 and parts[2].startswith('UTC'):
+                hours, minutes = parts[2][3:].split(':')
+                offset = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+                if hours.startswith('-'):
+                    offset = datetime.timedelta(hours=int(hours), minutes=-int(minutes))
+                date = date.replace(tzinfo=datetime.timezone(offset))
+            return int(date.timestamp())
+        except Exception as e:
+            print(f'Error parsing date {date_str}: {e}')
+            return 0
+
+    def parse_media(self, tag: str, attrs: dict, classes: list):
+        for css_class, media_type in self.conf['media_classes'].items():
+            if css_class in classes:
+                break
+        else:
+            return
+        attachment = {'type': media_type}
+        if media_type != 'poll':
+            # missing files are rendered as <div> instead of <a href=...>
+            href = attrs.get('href') if tag == 'a' else None
+            attachment['local_path'] = href if href else 'not_included'
+        self.part['attachments'] = [ attachment ]
+
+    def parse_service_msg(self, service_text: str):
+        self.msg['text'] = 'unknown'
+        self.msg['service_msg_data'] = service_text
+        self.msg['from_name'] = 'DELETED'
+        padded_text = f' {service_text} ' # phrases may be at the end, e.g. ' left group'
+        for phrase, action in self.conf['service_actions'].items():
+            if phrase in padded_text:
+                actor, _, msg_data = padded_text.partition(phrase)
+                self.msg['text'] = action
+                self.msg['from_name'] = actor.strip() or 'DELETED'
+                msg_data = msg_data.strip().strip('«»"')
+                if action == 'edit_group_title' or action == 'create_group':
+                    self.msg['service_msg_data'] = {'title': msg_data}
+                elif msg_data and action in ('invite_members', 'remove_members'):
+                    self.msg['service_msg_data'] = {'username': msg_data}
+                else:
+                    self.msg['service_msg_data'] = None
+                break
+
+class TGhtmlParser:
+    def __init__(self, input_path: str, proc_count: int):
+        tg_encoding, target_ext = 'utf-8', '.html'
+        self.inp = InputHandler(input_path, tg_encoding, target_ext)
+        self.proc_count = proc_count if MP_ENABLED else 1
+        print(f'TGhtmlParser process count: {self.proc_count}')
+        self.usernames_dict: dict[int, str] = {}
+        self.page_conf = {
+            # HTML tags used by Telegram Desktop -> tags used by TGjsonParser
+            'formatted_tags': {
+                'strong': 'b',
+                'b': 'b',
+                'em': 'i',
+                'i': 'i',
+                's': 's',
+                'strike': 's',
+                'blockquote': 'blockquote',
+                'code': 'tt',
+                'pre': 'tt'
+                },
+            # CSS classes of media blocks -> attachment types used by TGjsonParser
+            'media_classes': {
+                'photo_wrap': 'photo',
+                'media_photo': 'photo',
+                'video_file_wrap': 'video',
+                'media_video': 'video',
+                'animated_wrap': 'animation',
+                'sticker_wrap': 'sticker',
+                'media_voice_message': 'voice_message',
+                'media_audio_file': 'audio',
+                'media_file': 'file',
+                'media_poll': 'poll'
+                },
+            # Telegram Desktop always exports service messages in English
+            'service_actions': {
+                ' created group ': 'create_group',
+                ' invited ': 'invite_members',
+                ' joined group by link': 'join_group_by_link',
+                ' removed group photo': 'delete_group_photo',
+                ' removed ': 'remove_members',
+                ' left group': 'leave_chat',
+                ' pinned ': 'pin_message',
+                ' changed group title to ': 'edit_group_title',
+                ' changed group photo': 'edit_group_photo',
+                ' converted this group to a supergroup': 'migrate_to_supergroup'
+                }
+            }
+
+    def create_data_entries(self) -> list:
+        data_entries_list = []
+        target_filename = 'messages.html'
+        full_file_list = self.inp.get_file_list()
+        files_to_scan = [f for f in full_file_list if os.path.basename(f) == target_filename]
+        export_dirs_by_id = {}
+        for filename in files_to_scan:
+            try:
+                dir_path = os.path.dirname(filename)
+                files_in_same_dir = []
+                for f in full_file_list:
+                    if os.path.dirname(f) == dir_path and self.get_page_number(f):
+                        files_in_same_dir.append(f)
+                files_in_same_dir.sort(key=self.get_page_number)
+                page_parser = TGhtmlPageParser(self.page_conf)
+                page_parser.feed(self.inp.get_file(filename))
+                chat_name = page_parser.chat_name or 'DELETED'
+                chat_id = self.get_chat_id(dir_path, chat_name)
+                if chat_id in export_dirs_by_id:
+                    print(f'Warning: chats in {export_dirs_by_id[chat_id]} and {dir_path} have the same ID, '
+                          f'their messages will be merged')
+                export_dirs_by_id[chat_id] = dir_path
+                data_entry = {
+                    'chat_count': 1,
+                    'name': chat_name,
+                    'chat_id': chat_id,
+                    'path': dir_path,
+                    'files': files_in_same_dir}
+                data_entries_list.append(data_entry)
+            except Exception as e:
+                print(f'Skipping file {filename}: {e}')
+        return data_entries_list
+
+    def get_chat_id(self, dir_path: str, chat_name: str) -> int:
+        # chat names aren't unique, so the name of the export directory
+        # (e.g. 'ChatExport_2023-08-14') is hashed too
+        if self.inp.dir_mode:
+            export_name = os.path.basename(os.path.abspath(dir_path))
+        else:
+            export_name = posixpath.basename(dir_path) or os.path.basename(self.inp.input_path)
+        return synthetic_id(f'{export_name}/{chat_name}')
+
+    def get_page_number(self, filepath: str) -> int:
+        # messages.html, messages2.html, ... (0 for other files)
+        match = re.fullmatch(r'messages(\d*)\.html', os.path.basename(filepath))
+        if not match:
+            return 0
+        return int(match.group(1)) if match.group(1) else 1
+
+    def process_data_entry(self, data_entry: dict) -> list:
+        chat_users = {}
+        html_list = data_entry['files']
+        msg_list = []
+        html_results = self.inp.map_files(self.process_single_html, html_list, self.proc_count)
+        for message_chunk, users_subset in tqdm(html_results, total=len(html_list)):
+            msg_list.extend(message_chunk)
+            chat_users.update(users_subset)
+        self.usernames_dict.update(chat_users)
+
+        chat_id = data_entry['chat_id']
+        prev_from_id, prev_date = synthetic_id('DELETED'), 0
+        for msg in msg_list:
+            # "joined" messages (and pages starting with them) inherit the previous sender;
+            # service messages have no date of their own
+            if msg['from_id_orig'] is None:
+                msg['from_id_orig'] = prev_from_id
+            if not msg['date']:
+                msg['date'] = prev_date
+            msg['chat_id_orig'] = chat_id
+            prev_from_id, prev_date = msg['from_id_orig'], msg['date']
+            if msg.get('fwd_messages'):
+                msg['text'], msg['attachments'] = '', None
+        next_date = 0
+        for msg in reversed(msg_list): # service messages at the start of the chat
+            if not msg['date']:
+                msg['date'] = next_date
+            next_date = msg['date']
+        if synthetic_id('DELETED') in (m['from_id_orig'] for m in msg_list):
+            self.usernames_dict[synthetic_id('DELETED')] = 'DELETED'
+
+        # chat_users also has authors of forwarded messages, who aren't chat members
+        chat_authors = { msg['from_id_orig'] for msg in msg_list }
+        peer_type = 'group_chat' if len(chat_authors) > 2 else 'user'
+        chat_obj = {
+            'id': chat_id,
+            'peer_type': peer_type,
+            'name': data_entry['name'],
+            'msg_list': msg_list,
+            'media_dir': data_entry['path']} # attachments' local_path is relative to it
+        return [ chat_obj ]
+
+    def process_single_html(self, html_file: tuple):
+        html_path, raw_html = html_file # prefetched by InputHandler
+        page_parser = TGhtmlPageParser(self.page_conf)
+        page_parser.feed(raw_html)
+        page_parser.close()
+        return page_parser.msg_list, page_parser.users_subset
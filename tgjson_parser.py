@@ -1,4 +1,5 @@
 import json
+import os
 
 from input_handler import InputHandler
 
@@ -71,6 +72,9 @@ class TGjsonParser:
             for chat in json_data['chats']['list']:
                 chat_obj = self.process_single_chat(chat)
                 output_chat_list.append(chat_obj)
+        for chat_obj in output_chat_list:
+            # attachments' local_path is relative to the directory of result.json
+            chat_obj['media_dir'] = os.path.dirname( data_entry['path'] )
         return output_chat_list
 
     def process_single_chat(self, json_chat: dict) -> dict:
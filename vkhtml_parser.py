@@ -5,13 +5,7 @@ from base64 import b64decode
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 
-from input_handler import InputHandler
-
-try:
-    import multiprocessing
-    MP_ENABLED = True
-except:
-    MP_ENABLED = False
+from input_handler import MP_ENABLED, InputHandler
 
 class VKhtmlParser:
     def __init__(self, input_path: str, bs4_backend: str, proc_count: int):
@@ -103,17 +97,10 @@ class VKhtmlParser:
         peer_type = self.get_peer_type(chat_id)
         html_list = data_entry['files']
         msg_list = []
-        if self.proc_count != 1:
-            with multiprocessing.Pool(self.proc_count) as pool:
-                p = pool.imap(self.process_single_html, html_list, chunksize=8)
-                for message_chunk, users_subset in tqdm(p, total=len(html_list)):
-                    msg_list.extend(message_chunk)
-                    chat_users.update(users_subset)
-        else:
-            for file in tqdm(html_list):
-                message_chunk, users_subset = self.process_single_html(file)
-                msg_list.extend(message_chunk)
-                chat_users.update(users_subset)
+        html_results = self.inp.map_files(self.process_single_html, html_list, self.proc_count)
+        for message_chunk, users_subset in tqdm(html_results, total=len(html_list)):
+            msg_list.extend(message_chunk)
+            chat_users.update(users_subset)
         self.usernames_dict.update(chat_users)
         chat_obj = {
             'id': chat_id,
@@ -122,11 +109,11 @@ class VKhtmlParser:
             'msg_list': msg_list}
         return [ chat_obj ]
 
-    def process_single_html(self, html_path: str):
+    def process_single_html(self, html_file: tuple):
+        html_path, raw_html = html_file # prefetched by InputHandler
         chat_id = os.path.basename(os.path.dirname(html_path))
         msg_list = []
         users_subset = {}
-        raw_html = self.inp.get_file(html_path)
         soup = BeautifulSoup(raw_html, self.bs4_backend)
 
         for msg_div in soup.find_all('div', class_='message'):